@@ -11,9 +11,46 @@
 
 import yaml
 import argparse
+import logging
 import sys
 from typing import Dict, List
 
+log = logging.getLogger(__name__)
+
+# 优先使用 libyaml 的 C 扩展解析器和序列化器（大配置文件可提速约 9-15 倍），
+# 如果 PyYAML 编译时没有带 libyaml，则回退到纯 Python 实现
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+def _load_proxies(buffer: str) -> List:
+    """
+    只解析并构造配置中的 proxies 部分
+
+    Clash 配置的大头通常是 rules、rule-providers 等与转换无关的内容，
+    这里先把文档 compose 成节点树，再只对 proxies 子树构造 Python 对象，
+    跳过其余部分的构造开销。
+
+    :param buffer: 完整的 YAML 文本
+    :return: 代理节点列表
+    :raises ValueError: 当配置为空或缺少合法的 proxies 部分时抛出
+    """
+    loader = Loader(buffer)
+    try:
+        root = loader.get_single_node()
+        if root is None or not isinstance(root, yaml.MappingNode):
+            raise ValueError("YAML 文件为空或格式错误")
+
+        for key_node, value_node in root.value:
+            if key_node.value == 'proxies':
+                proxies = loader.construct_document(value_node)
+                if not isinstance(proxies, list):
+                    raise ValueError("proxies 部分格式错误，应该是一个列表")
+                return proxies
+
+        raise ValueError("无效的 Clash 配置文件，缺少 proxies 部分")
+    finally:
+        loader.dispose()
+
 def convert_to_socks_proxies(input_file: str, start_port: int = 42000) -> Dict:
     """
     将 Clash 配置文件转换为本地 SOCKS 代理配置
@@ -29,31 +66,33 @@ def convert_to_socks_proxies(input_file: str, start_port: int = 42000) -> Dict:
     :return: 包含完整配置信息的字典
     :raises ValueError: 当输入文件格式不正确或缺少必要信息时抛出
     """
-    print(f"开始处理文件: {input_file}")  # 调试信息
+    log.debug("开始处理文件: %s", input_file)
     
     try:
-        # 读取并解析 YAML 文件
+        # 读取 YAML 文件
         with open(input_file, 'r', encoding='utf-8') as f:
-            print("正在读取文件...")  # 调试信息
-            yaml_data = yaml.safe_load(f)
-            print("文件读取完成")  # 调试信息
+            log.debug("正在读取文件...")
+            # 先整体读入缓冲区再解析，libyaml 解析缓冲区比流式读取文件对象更快
+            buffer = f.read()
+            log.debug("文件读取完成")
     except Exception as e:
         print(f"读取文件时出错: {str(e)}", file=sys.stderr)
         raise
-    
-    # 验证配置文件格式
-    if not yaml_data:
-        raise ValueError("YAML 文件为空或格式错误")
-    
-    if 'proxies' not in yaml_data:
-        raise ValueError("无效的 Clash 配置文件，缺少 proxies 部分")
-    
-    if not isinstance(yaml_data['proxies'], list):
-        raise ValueError("proxies 部分格式错误，应该是一个列表")
-    
+
+    # 只构造 proxies 子树，其余部分（rules 等）不做对象构造
+    all_proxies = _load_proxies(buffer)
+
+    # 合并订阅的配置里经常出现重名节点，Clash 会拒绝引用它们的监听器，
+    # 这里按名称去重，只保留第一次出现的节点
+    seen = set()
+    proxies = [p for p in all_proxies if not (p['name'] in seen or seen.add(p['name']))]
+    num_duplicates = len(all_proxies) - len(proxies)
+    if num_duplicates:
+        log.warning("跳过 %d 个重名代理节点", num_duplicates)
+
     # 获取代理节点数量
-    num_proxies = len(yaml_data['proxies'])
-    print(f"找到 {num_proxies} 个代理节点")  # 调试信息
+    num_proxies = len(proxies)
+    log.debug("找到 %d 个代理节点", num_proxies)
     
     # 创建新的配置字典，包含基础设置
     new_config = {
@@ -68,10 +107,10 @@ def convert_to_socks_proxies(input_file: str, start_port: int = 42000) -> Dict:
             'nameserver': ['https://doh.pub/dns-query']  # DoH (DNS over HTTPS) 服务器
         },
         'listeners': [],  # 初始化空的监听器列表
-        'proxies': yaml_data['proxies']  # 保留原始代理配置
+        'proxies': proxies  # 保留去重后的代理配置
     }
     
-    print("正在创建监听器配置...")  # 调试信息
+    log.debug("正在创建监听器配置...")
     
     # 为每个代理创建对应的本地 SOCKS 监听器
     new_config['listeners'] = [
@@ -81,37 +120,61 @@ def convert_to_socks_proxies(input_file: str, start_port: int = 42000) -> Dict:
             'port': start_port + i,  # 监听端口号，从 start_port 递增
             'proxy': proxy['name']   # 关联的代理节点名称
         }
-        for i, proxy in enumerate(yaml_data['proxies'])
+        for i, proxy in enumerate(proxies)
     ]
     
-    print("配置转换完成")  # 调试信息
+    log.debug("配置转换完成")
     return new_config
 
+def port_type(value: str) -> int:
+    """
+    校验命令行传入的端口号在合法范围内
+
+    :param value: 命令行参数原始字符串
+    :return: 端口号整数
+    :raises argparse.ArgumentTypeError: 当端口号不在 1-65535 范围内时抛出
+    """
+    port = int(value)
+    if not 0 < port < 65536:
+        raise argparse.ArgumentTypeError(f"端口号 {port} 超出范围 (1-65535)")
+    return port
+
 def main():
     """
     主函数：处理命令行参数并执行转换流程
     """
-    # 设置命令行参数解析
+    logging.basicConfig(level=logging.INFO)
+
+    # 设置命令行参数解析，非法参数由 argparse 自己打印用法并退出
     parser = argparse.ArgumentParser(description='将 Clash 代理节点转换为本地 SOCKS 代理')
     parser.add_argument('input', help='输入的 Clash 配置文件路径')
     parser.add_argument('-o', '--output', default='config.yaml', help='输出的配置文件路径')
-    parser.add_argument('-p', '--port', type=int, default=42000, help='起始端口号')
-    
-    try:
-        args = parser.parse_args()
-        print(f"参数解析完成: 输入={args.input}, 输出={args.output}, 端口={args.port}")  # 调试信息
-    except Exception as e:
-        print(f"参数解析错误: {str(e)}", file=sys.stderr)
-        sys.exit(1)
-    
+    parser.add_argument('-p', '--port', type=port_type, default=42000, help='起始端口号 (1-65535)')
+
+    args = parser.parse_args()
+    log.debug("参数解析完成: 输入=%s, 输出=%s, 端口=%s", args.input, args.output, args.port)
+
     try:
         # 执行转换
         config = convert_to_socks_proxies(args.input, args.port)
         
         # 将新配置写入文件
-        print(f"正在写入配置到文件: {args.output}")  # 调试信息
+        log.debug("正在写入配置到文件: %s", args.output)
         with open(args.output, 'w', encoding='utf-8') as f:
-            yaml.dump(config, f, allow_unicode=True)
+            # 先写入除 listeners 外的基础配置
+            base_config = {k: v for k, v in config.items() if k != 'listeners'}
+            yaml.dump(base_config, f, Dumper=Dumper, allow_unicode=True)
+
+            # listeners 分块追加序列化，避免为上万个监听器一次性
+            # 构建整棵表示树，峰值内存只和块大小相关
+            listeners = config['listeners']
+            if listeners:
+                f.write('listeners:\n')
+                for i in range(0, len(listeners), 1000):
+                    yaml.dump(listeners[i:i + 1000], f, Dumper=Dumper,
+                              allow_unicode=True, default_flow_style=False)
+            else:
+                f.write('listeners: []\n')
         
         # 输出转换结果信息
         print(f"转换成功！配置文件已保存到 {args.output}")
@@ -12,19 +12,41 @@
 """
 
 import yaml
-import requests
+import httpx
+import orjson
+import asyncio
 import time
 import socket
-import pandas as pd
-import concurrent.futures
-from tqdm import tqdm
+import csv
+from collections import Counter
+from tqdm.asyncio import tqdm
 import argparse
+import hashlib
+import logging
+import os
+import random
 import sys
 import json
 
+log = logging.getLogger(__name__)
+
+# 地理信息缓存文件，跨运行复用查询结果
+GEO_CACHE_FILE = os.path.expanduser('~/.cache/proxy_geo.json')
+
+# 不同代理经常共用同一个出口IP（CDN前端、同一机房的地址池），
+# 按IP缓存地理信息，重复IP不再触发外部查询
+_geo_cache = {}
+
+# 优先使用 libyaml 的 C 扩展解析器（大配置文件可提速约 9-15 倍），
+# 如果 PyYAML 编译时没有带 libyaml，则回退到纯 Python 实现
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 # 设置超时时间
 TIMEOUT = 8  # 秒
 MAX_RETRIES = 3  # 最大重试次数
+BACKOFF_BASE = 1  # 重试退避基数（秒）
+BACKOFF_CAP = 30  # 重试退避上限（秒）
+HEDGE_DELAY = 2  # 发起对冲请求前的等待时间（秒）
 
 def load_config(config_file):
     """
@@ -35,17 +57,66 @@ def load_config(config_file):
     """
     try:
         with open(config_file, 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f)
+            # 先整体读入缓冲区再解析，libyaml 解析缓冲区比流式读取文件对象更快
+            return yaml.load(f.read(), Loader=Loader)
     except Exception as e:
         print(f"读取配置文件时出错: {str(e)}", file=sys.stderr)
         sys.exit(1)
 
-def test_single_proxy_attempt(proxy_info):
+def load_geo_cache():
+    """
+    从磁盘加载地理信息缓存，文件不存在或损坏时保持缓存为空
+    """
+    try:
+        with open(GEO_CACHE_FILE, 'rb') as f:
+            _geo_cache.update(orjson.loads(f.read()))
+    except (OSError, ValueError):
+        pass
+
+def save_geo_cache():
+    """
+    把地理信息缓存写回磁盘，供下次运行复用
+    """
+    try:
+        os.makedirs(os.path.dirname(GEO_CACHE_FILE), exist_ok=True)
+        with open(GEO_CACHE_FILE, 'wb') as f:
+            f.write(orjson.dumps(_geo_cache))
+    except OSError:
+        pass
+
+async def geo_lookup(ip):
+    """
+    查询指定IP的地理位置信息，先查缓存，未命中时直连 ipinfo
+
+    :param ip: 要查询的IP地址
+    :return: ipinfo 返回的地理信息字典
+    """
+    if ip not in _geo_cache:
+        async with httpx.AsyncClient(timeout=TIMEOUT) as client:
+            response = await client.get(f'https://ipinfo.io/{ip}/json')
+            response.raise_for_status()
+            _geo_cache[ip] = orjson.loads(response.content)
+    return _geo_cache[ip]
+
+def proxy_cache_key(proxy_info):
+    """
+    计算监听器配置的稳定指纹，配置不变则指纹不变
+
+    BLAKE2 在现代CPU上比MD5更快，而且就在标准库里。
+
+    :param proxy_info: 代理信息字典
+    :return: 十六进制指纹字符串
+    """
+    payload = json.dumps(proxy_info, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+async def test_single_proxy_attempt(proxy_info, client):
     """
     单次测试代理连接
-    
+
     :param proxy_info: 代理信息字典
-    :return: 包含测试结果的字典和成功标志
+    :param client: 该代理专用的 httpx.AsyncClient
+    :return: (测试结果字典, 成功标志, 失败是否值得重试)
     """
     name = proxy_info["name"]
     port = proxy_info["port"]
@@ -65,106 +136,218 @@ def test_single_proxy_attempt(proxy_info):
         "延迟(ms)": "-"
     }
     
-    # 设置代理
-    proxies = {
-        'http': proxy_url,
-        'https': proxy_url
-    }
-    
+    # 快速路径：先用极短超时探测本地端口是否有监听，
+    # 监听器没起来就不必走完整的 HTTPS 往返和 8 秒超时
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection('127.0.0.1', port), timeout=0.2)
+        writer.close()
+        await writer.wait_closed()
+    except (OSError, asyncio.TimeoutError):
+        result["状态"] = "监听器未就绪"
+        return result, False, False
+
     success = False
+    retryable = False
     # 测试连接
     try:
         # 计时开始
         start_time = time.time()
-        
-        # 通过代理获取IP信息
-        response = requests.get('https://api.ipify.org?format=json', 
-                               proxies=proxies, 
-                               timeout=TIMEOUT)
-        
+
+        # 通过代理一次性获取出口IP和地理位置信息，
+        # 比先查 ipify 再查 ipinfo 少一次完整往返
+        response = await client.get('https://ipinfo.io/json')
+
         # 计算延迟
         elapsed = (time.time() - start_time) * 1000  # 转换为毫秒
-        
+
         if response.status_code == 200:
-            ip_address = response.json()['ip']
-            
-            # 获取IP地理位置信息
-            geo_response = requests.get(f'https://ipinfo.io/{ip_address}/json', timeout=TIMEOUT)
-            if geo_response.status_code == 200:
-                geo_data = geo_response.json()
-                country = geo_data.get('country', '-')
-                city = geo_data.get('city', '-')
-                org = geo_data.get('org', '-')
-            else:
-                country = "未知"
-                city = "未知"
-                org = "未知"
-            
+            # orjson 的 C 实现比标准库 json 解码快 2-5 倍
+            geo_data = orjson.loads(response.content)
+
+            # 顺手写入地理信息缓存，限流退路和后续运行都能复用
+            if 'ip' in geo_data:
+                _geo_cache[geo_data['ip']] = geo_data
+
             # 更新结果
             result.update({
                 "状态": "成功",
-                "IP地址": ip_address,
-                "国家/地区": country,
-                "城市": city,
-                "运营商": org,
+                "IP地址": geo_data.get('ip', '-'),
+                "国家/地区": geo_data.get('country', '-'),
+                "城市": geo_data.get('city', '-'),
+                "运营商": geo_data.get('org', '-'),
                 "延迟(ms)": f"{elapsed:.2f}"
             })
             success = True
-    except requests.exceptions.Timeout:
+        elif response.status_code == 429:
+            # ipinfo 对该出口IP限流：退回 ipify 只拿IP，
+            # 地理信息走缓存，未命中时再直连查询一次
+            start_time = time.time()
+            response = await client.get('https://api.ipify.org?format=json')
+            elapsed = (time.time() - start_time) * 1000
+
+            if response.status_code == 200:
+                ip_address = orjson.loads(response.content)['ip']
+                geo_data = await geo_lookup(ip_address)
+
+                result.update({
+                    "状态": "成功",
+                    "IP地址": ip_address,
+                    "国家/地区": geo_data.get('country', '-'),
+                    "城市": geo_data.get('city', '-'),
+                    "运营商": geo_data.get('org', '-'),
+                    "延迟(ms)": f"{elapsed:.2f}"
+                })
+                success = True
+            else:
+                result["状态"] = f"失败: HTTP {response.status_code}"
+                retryable = response.status_code >= 500
+        elif response.status_code >= 500:
+            # 服务端暂时性错误，值得重试
+            result["状态"] = f"失败: HTTP {response.status_code}"
+            retryable = True
+        else:
+            # 4xx 属于确定性失败，重试没有意义
+            result["状态"] = f"失败: HTTP {response.status_code}"
+    except httpx.TimeoutException:
         # 连接超时
         result["状态"] = "超时"
-    except requests.exceptions.ProxyError:
+        retryable = True
+    except httpx.ProxyError:
         # 代理错误
         result["状态"] = "代理错误"
-    except requests.RequestException as e:
-        # 连接失败
+        retryable = True
+    except httpx.ConnectError as e:
+        # DNS解析失败、证书无效等，重试基本无望，直接放弃
+        result["状态"] = f"失败: {type(e).__name__}"
+    except httpx.HTTPError as e:
+        # 其他连接失败
         result["状态"] = f"失败: {type(e).__name__}"
+        retryable = True
     except Exception as e:
         # 其他错误
         result["状态"] = f"错误: {type(e).__name__}"
-    
-    return result, success
 
-def test_proxy(proxy_info):
+    return result, success, retryable
+
+async def hedged_proxy_attempt(proxy_info, client):
+    """
+    对冲式测试：先发起一次探测，如果超过 HEDGE_DELAY 秒还没有返回，
+    并发再发一次请求和它赛跑，取最先成功的结果并取消输掉的那个。
+    这样偶尔卡顿但本身可用的代理不用等满整个超时时间。
+
+    :param proxy_info: 代理信息字典
+    :param client: 该代理专用的 httpx.AsyncClient
+    :return: (测试结果字典, 成功标志, 失败是否值得重试)
+    """
+    first = asyncio.ensure_future(test_single_proxy_attempt(proxy_info, client))
+    done, pending = await asyncio.wait({first}, timeout=HEDGE_DELAY)
+
+    # 第一次尝试在对冲窗口内就返回了，直接用它的结果
+    if first in done:
+        return first.result()
+
+    # 第一次尝试卡住了，发起对冲请求和它赛跑
+    pending.add(asyncio.ensure_future(test_single_proxy_attempt(proxy_info, client)))
+    outcome = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            outcome = task.result()
+            if outcome[1]:
+                # 有一个成功了，取消还在跑的那个
+                for loser in pending:
+                    loser.cancel()
+                return outcome
+    # 两次都失败，返回最后完成的结果
+    return outcome
+
+async def test_proxy(proxy_info, semaphore):
     """
     测试单个代理，失败时最多重试3次
-    
+
     :param proxy_info: 代理信息字典
+    :param semaphore: 限制并发数量的信号量
     :return: 包含测试结果的字典
     """
-    # 第一次尝试
-    result, success = test_single_proxy_attempt(proxy_info)
-    
-    # 如果成功，直接返回结果
-    if success:
-        return result
-    
-    # 失败后重试
-    retry_count = 1
-    while retry_count < MAX_RETRIES:
-        retry_count += 1
-        # 稍微等待一下再重试
-        time.sleep(1)
-        
-        print(f"正在重试 {proxy_info['name']} (端口 {proxy_info['port']})，第 {retry_count} 次...")
-        retry_result, retry_success = test_single_proxy_attempt(proxy_info)
-        
-        # 如果重试成功，返回重试的结果
-        if retry_success:
-            retry_result["状态"] += f" (重试 {retry_count} 次)"
-            return retry_result
-    
-    # 所有重试都失败后，返回最后一次的结果
-    result["状态"] += f" (已重试 {MAX_RETRIES} 次)"
-    return result
+    async with semaphore:
+        proxy_url = f"socks5://127.0.0.1:{proxy_info['port']}"
+
+        # 一个代理的所有尝试共用同一个客户端，
+        # 连接池的 keep-alive 让重试和对冲请求复用已建好的 TCP+TLS 连接
+        async with httpx.AsyncClient(proxy=proxy_url, timeout=TIMEOUT) as client:
+            # 第一次尝试（内部带对冲）
+            result, success, retryable = await hedged_proxy_attempt(proxy_info, client)
+
+            # 如果成功，直接返回结果
+            if success:
+                return result
+
+            # 只对可恢复的失败（超时、代理错误、5xx）进行重试
+            retry_count = 1
+            while retryable and retry_count < MAX_RETRIES:
+                retry_count += 1
+                # 指数退避加随机抖动，避免大量并发任务同步重试形成冲击
+                backoff = min(BACKOFF_CAP, BACKOFF_BASE * (2 ** (retry_count - 1)))
+                await asyncio.sleep(backoff * (1 + random.uniform(0, 0.5)))
+
+                log.info("正在重试 %s (端口 %s)，第 %d 次...", proxy_info['name'], proxy_info['port'], retry_count)
+                retry_result, retry_success, retryable = await hedged_proxy_attempt(proxy_info, client)
+
+                # 如果重试成功，返回重试的结果
+                if retry_success:
+                    retry_result["状态"] += f" (重试 {retry_count} 次)"
+                    return retry_result
+
+            # 所有重试都失败后，返回最后一次的结果
+            if retry_count > 1:
+                result["状态"] += f" (已重试 {retry_count} 次)"
+            return result
+
+async def run_tests(proxies, concurrency, writer, csv_file):
+    """
+    并发测试所有代理，结果边完成边写入CSV
+
+    增量写盘让内存占用只和在途任务数相关，而且中途崩溃时
+    已完成的结果也保留在文件里。
+
+    :param proxies: 代理信息列表
+    :param concurrency: 最大并发数
+    :param writer: 输出用的 csv.DictWriter
+    :param csv_file: writer 底层的文件对象，用于定期刷盘
+    :return: 完成测试的代理数量
+    """
+    # 单线程事件循环 + 信号量限流，代替原来的线程池
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [asyncio.ensure_future(test_proxy(proxy, semaphore)) for proxy in proxies]
+
+    completed = 0
+    for future in tqdm.as_completed(tasks, total=len(tasks), desc="测试进度"):
+        try:
+            result = await future
+        except Exception as e:
+            print(f"测试过程中出错: {str(e)}", file=sys.stderr)
+            continue
+        writer.writerow(result)
+        completed += 1
+        # 每 50 行刷一次盘
+        if completed % 50 == 0:
+            csv_file.flush()
+    return completed
 
 def main():
+    logging.basicConfig(level=logging.INFO)
+
     # 解析命令行参数
     parser = argparse.ArgumentParser(description='测试SOCKS5代理连接状态和性能')
     parser.add_argument('-c', '--config', default='output.yaml', help='配置文件路径')
     parser.add_argument('-o', '--output', default='proxy_results.csv', help='结果输出文件路径')
-    parser.add_argument('-t', '--threads', type=int, default=5, help='并发测试线程数')
+    parser.add_argument('-t', '--threads', type=int, default=100, help='并发测试数量')
     parser.add_argument('-n', '--num', type=int, default=0, help='要测试的代理数量，0表示全部')
+    parser.add_argument('--incremental', action='store_true',
+                        help='复用上次未过期的测试结果，只重新测试配置有变化或过期的代理')
+    parser.add_argument('--max-age', type=int, default=3600,
+                        help='增量模式下缓存结果的有效期（秒，默认3600）')
     args = parser.parse_args()
     
     # 读取配置文件
@@ -183,58 +366,85 @@ def main():
         
     print(f"找到 {len(proxies)} 个代理配置")
     
-    # 创建结果列表
-    results = []
-    
-    # 使用线程池进行并发测试
-    print(f"开始测试，使用 {args.threads} 个并发线程")
-    with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
-        # 提交所有任务并使用tqdm显示进度
-        futures = [executor.submit(test_proxy, proxy) for proxy in proxies]
-        for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), desc="测试进度"):
-            try:
-                result = future.result()
-                results.append(result)
-            except Exception as e:
-                print(f"测试过程中出错: {str(e)}", file=sys.stderr)
-    
+    fieldnames = ['序号', '名称', '代理名', '端口', '代理地址', '状态',
+                  'IP地址', '国家/地区', '城市', '运营商', '延迟(ms)']
+
+    # 增量模式：按配置指纹复用未过期的上次结果，只测试剩下的代理
+    result_cache_file = f"{args.output}.cache.json"
+    reused_entries = {}
+    cached_results = []
+    to_test = proxies
+    if args.incremental:
+        try:
+            with open(result_cache_file, 'rb') as f:
+                result_cache = orjson.loads(f.read())
+        except (OSError, ValueError):
+            result_cache = {}
+
+        now = time.time()
+        to_test = []
+        for proxy in proxies:
+            key = proxy_cache_key(proxy)
+            entry = result_cache.get(key)
+            if entry and now - entry[0] <= args.max_age:
+                reused_entries[key] = entry
+                cached_results.append(entry[1])
+            else:
+                to_test.append(proxy)
+        if cached_results:
+            print(f"增量模式: 复用 {len(cached_results)} 个缓存结果，重新测试 {len(to_test)} 个代理")
+
+    # 加载上次运行留下的地理信息缓存
+    load_geo_cache()
+
+    # 在单个事件循环中进行并发测试，结果边完成边写入CSV
+    print(f"开始测试，最大并发数 {args.threads}")
+    with open(args.output, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, restval='', extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(cached_results)
+        completed = asyncio.run(run_tests(to_test, args.threads, writer, f))
+
+    # 把新增的地理信息写回缓存文件
+    save_geo_cache()
+
     # 如果没有结果，退出
-    if not results:
+    if not completed and not cached_results:
         print("没有测试结果", file=sys.stderr)
         sys.exit(1)
-    
-    # 创建DataFrame并按状态和延迟排序
-    df = pd.DataFrame(results)
-    
-    # 将延迟列转换为数值类型进行排序
-    df['延迟数值'] = pd.to_numeric(df['延迟(ms)'].str.replace('-', 'NaN'), errors='coerce')
-    
-    # 添加序号列
-    df['序号'] = range(1, len(df) + 1)
-    
-    # 按照端口列升序排序
-    df = df.sort_values('端口', ascending=True)
-    
-    # 重新调整序号
-    df['序号'] = range(1, len(df) + 1)
-    
-    # 重新调整列顺序，将序号放在最前面
-    cols = df.columns.tolist()
-    cols.remove('序号')
-    df = df[['序号'] + cols]
-    
-    # 删除临时的延迟数值列
-    df = df.drop('延迟数值', axis=1)
-    
-    # 保存结果到CSV
-    df.to_csv(args.output, index=False, encoding='utf-8-sig')
-    
-    # 统计各状态数量
-    status_counts = {}
-    for status in df['状态']:
-        base_status = status.split(" (")[0]  # 提取基本状态，忽略重试信息
-        status_counts[base_status] = status_counts.get(base_status, 0) + 1
-    
+
+    # 第二遍：读回CSV，按照端口升序排序并编号后重写
+    with open(args.output, 'r', encoding='utf-8-sig', newline='') as f:
+        results = list(csv.DictReader(f))
+
+    results.sort(key=lambda r: int(r['端口']))
+    for i, r in enumerate(results, 1):
+        r['序号'] = i
+
+    with open(args.output, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(results)
+
+    # 增量模式：把本次结果按指纹写回缓存，复用的条目保留原时间戳以便正常过期
+    if args.incremental:
+        key_by_port = {str(p['port']): proxy_cache_key(p) for p in proxies}
+        now = time.time()
+        new_cache = {}
+        for r in results:
+            key = key_by_port.get(str(r['端口']))
+            if key is not None:
+                new_cache[key] = reused_entries.get(key, [now, dict(r)])
+        try:
+            with open(result_cache_file, 'wb') as f:
+                f.write(orjson.dumps(new_cache))
+        except OSError:
+            pass
+
+    # 统计各状态数量（忽略重试后缀）。partition 在第一个分隔符处就停，
+    # 也不像 split 那样分配列表，大结果集下更快
+    status_counts = Counter(r['状态'].partition(' (')[0] for r in results)
+
     success_count = status_counts.get('成功', 0)
     
     # 显示结果统计
@@ -248,13 +458,18 @@ def main():
     
     print(f"\n结果已保存到: {args.output}")
     
-    # 打印一些示例结果
-    if not df.empty:
-        # 只显示成功的代理
-        success_df = df[df['状态'].str.startswith('成功')]
-        if not success_df.empty:
-            print("\n成功连接的代理示例:")
-            print(success_df.head(5).to_string(index=False))
+    # 打印一些示例结果，只显示成功的代理
+    success_samples = [r for r in results if r['状态'].startswith('成功')][:5]
+    if success_samples:
+        print("\n成功连接的代理示例:")
+        # 按每列内容的最大宽度对齐
+        widths = {
+            name: max(len(str(name)), *(len(str(r[name])) for r in success_samples))
+            for name in fieldnames
+        }
+        print('  '.join(str(name).ljust(widths[name]) for name in fieldnames))
+        for r in success_samples:
+            print('  '.join(str(r[name]).ljust(widths[name]) for name in fieldnames))
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file